@@ -3,72 +3,530 @@ This class is responsible for storing all the information about the current stat
 will be responsible for determining valid moves at the current state of the game. It will keep the log of the moves.
 """
 import numpy as np
+from numba import njit
+
+# Piece indices used by the bitboards, white pieces are 0..5 and black pieces are 6..11.
+WP, WN, WB, WR, WQ, WK, BP, BN, BB, BR, BQ, BK = range(12)
+# Board strings of the pieces in the same order as the piece indices.
+PIECE_CHARS = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+PIECE_INDEX = {name: i for i, name in enumerate(PIECE_CHARS)}
+# Mailbox value of an empty square, every other value is a piece index + 1.
+EMPTY = 0
+# Board strings indexed by the mailbox value of a square, '--' is an empty square.
+SQUARE_CHARS = ('--',) + PIECE_CHARS
+# File letters indexed by column and rank digits indexed by row, row 0 is the 8th rank.
+FILES = "abcdefgh"
+RANKS = "87654321"
+# Rank-File name of every square, like e4, indexed by row*8 + col.
+SQUARE_NAMES = tuple(FILES[sq & 7] + RANKS[sq >> 3] for sq in range(64))
+
+# (row, col) steps of the pieces. The king and the pawn captures use single steps along the slider directions.
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+
+
+"""
+Build a 64 entry table giving the bitboard of squares reachable from each square with one of the offsets.
+"""
+def build_attack_table(offsets):
+    table = np.zeros(64, dtype=np.uint64)
+    for sq in range(64):
+        attacks = 0
+        for dr, dc in offsets:
+            r = (sq >> 3) + dr
+            c = (sq & 7) + dc
+            if 0 <= r < 8 and 0 <= c < 8:
+                attacks |= 1 << (r*8 + c)
+        table[sq] = attacks
+    return table
+
+
+KNIGHT_ATTACKS = build_attack_table(KNIGHT_OFFSETS)
+KING_ATTACKS = build_attack_table(QUEEN_DIRECTIONS)
+# Squares attacked by a white or black pawn standing on each square, the two diagonals towards the enemy side.
+WHITE_PAWN_ATTACKS = build_attack_table(BISHOP_DIRECTIONS[:2])
+BLACK_PAWN_ATTACKS = build_attack_table(BISHOP_DIRECTIONS[2:])
+
+# Bitboard constants used inside the jitted functions are numpy uint64, mixing them with python ints would make
+# numba fall back to signed or float arithmetic.
+ONE = np.uint64(1)
+FILE_A = np.uint64(0x0101010101010101)
+FILE_H = np.uint64(0x8080808080808080)
+# Rows 5 and 2, where white and black pawns land after a single step from their start row.
+RANK_3 = np.uint64(0xFF << 40)
+RANK_6 = np.uint64(0xFF << 16)
+# Products in the magic lookup have to be cut back to 64 bits since python ints never overflow.
+MASK64 = (1 << 64) - 1
+
+# Magic multipliers for the square layout used here (square 0 is a8), found once with a random search.
+ROOK_MAGIC = np.array((
+    0x2080001440022581, 0x1080200040001080, 0x4080100008200080, 0x0280080080100254,
+    0x4D8004000A180080, 0x0100080400020100, 0x1080010040800200, 0x0200004402002081,
+    0x0068800024884004, 0x1000804000802002, 0x000200208A001040, 0x3008801000800800,
+    0x2006001060440A00, 0x1000800200800400, 0x0004000441024810, 0xA001000082004100,
+    0x0040808000204014, 0x0000424002201000, 0x0010110041002000, 0x0000090021041000,
+    0x0204008004800800, 0x0000808004000200, 0x6006040021485042, 0x0000020002409924,
+    0x2000401980028020, 0x4000400100308100, 0x0000820200201041, 0xB100100080800800,
+    0x3004080080040080, 0x0802000200041009, 0x01A0580400021110, 0x00020042000408A1,
+    0x4218884000800023, 0x0480201000400045, 0x0010200080801000, 0x1200200901001000,
+    0x0000100801000500, 0x0080020080800400, 0x004A000100404080, 0x0480005402001081,
+    0x258000402000C000, 0xA010004820084002, 0x0480200010008080, 0x244100100021000C,
+    0x2040080005010010, 0x0012000810020004, 0x0011000200B9000C, 0x1121000080410002,
+    0x00082080410A0600, 0x4002008100402600, 0x0A0300E008544100, 0x7B00080010008080,
+    0x0300080100100500, 0x0002020080040080, 0x0042521810214400, 0x8A00004089140200,
+    0x00001280010A2041, 0x0400401102042086, 0x41902000100C4101, 0x0043020420900009,
+    0x00E2000410082002, 0x4402000108041002, 0x2100101A00814804, 0x0400010400218246,
+), dtype=np.uint64)
+BISHOP_MAGIC = np.array((
+    0x0102040418220020, 0x0108024802002028, 0x8010044040400001, 0x0022209200044800,
+    0x4004504005040114, 0x0022010420A80800, 0x0008441008090002, 0x0000420801480200,
+    0x1100220244011C00, 0x00883004081AB020, 0x4400100152002000, 0x4019080841004000,
+    0x2861021210000000, 0x400EA10108400020, 0x4800208208A24000, 0x0020A500A0842085,
+    0x3410000802504400, 0x0010E0200C010060, 0x0014182042408200, 0x4094006840112109,
+    0x2014200202010000, 0x000100020080C400, 0x800400420D2C0200, 0x0002200182251000,
+    0x0010F10304C41000, 0x001024A008281084, 0x0088110002040100, 0x0820080001004008,
+    0x0104040020410050, 0x0110002027040500, 0x418C008009182100, 0x2C00A9040C80480B,
+    0x008110C8005020A4, 0x4004210802041000, 0x0004020108208100, 0x0000080800120A00,
+    0x430C008400820102, 0x1400808100020108, 0x005006020010A8A0, 0x000801868004A220,
+    0x00420105C00C2000, 0x1010921032019040, 0x0300222028103000, 0x0008004208001080,
+    0x5410202248811400, 0x0008010800800808, 0x3C02C20404000900, 0x0408022282040032,
+    0x0000941002100000, 0x0112209A10100804, 0x080C020111210000, 0x442002A442022008,
+    0x00084A181B040000, 0x00115021021C2080, 0x4010051000A20000, 0x0404688085060000,
+    0x0000220110011000, 0x140000220734200C, 0x0440010424020800, 0x2204828883460800,
+    0x0020000004050410, 0x4060004A20082080, 0x00489034B002C201, 0x0444049010410300,
+), dtype=np.uint64)
+
+
+"""
+Trace the sliding attacks from a square along the directions, each ray stops at the first occupied square.
+This is the slow way and is only used to fill the magic tables.
+"""
+def sliding_attacks(sq, occ, directions):
+    attacks = 0
+    for dr, dc in directions:
+        r = (sq >> 3) + dr
+        c = (sq & 7) + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            attacks |= 1 << (r*8 + c)
+            if occ >> (r*8 + c) & 1:
+                break
+            r += dr
+            c += dc
+    return attacks
+
+
+"""
+Build the relevant occupancy mask, ray squares for which a blocker changes the attacks. The last square of each ray is
+left out because a piece there never hides anything behind it.
+"""
+def sliding_mask(sq, directions):
+    mask = 0
+    for dr, dc in directions:
+        r = (sq >> 3) + dr
+        c = (sq & 7) + dc
+        while 0 <= r + dr < 8 and 0 <= c + dc < 8:
+            mask |= 1 << (r*8 + c)
+            r += dr
+            c += dc
+    return mask
+
+
+"""
+Build the masks, shifts, offsets and attack table so that the attacks from sq are
+attacks[offset[sq] + (((occ & mask[sq]) * magics[sq]) >> shift[sq])]. The entries of all squares are packed one after
+another in a single array, which keeps the rook table small enough for numba to freeze it into the compiled code.
+"""
+def build_magic_tables(directions, magics):
+    masks = np.zeros(64, dtype=np.uint64)
+    shifts = np.zeros(64, dtype=np.uint64)
+    offsets = np.zeros(64, dtype=np.uint64)
+    attacks = []
+    for sq in range(64):
+        mask = sliding_mask(sq, directions)
+        shift = 64 - bin(mask).count('1')
+        magic = int(magics[sq])
+        table = [0]*(1 << (64 - shift))
+        # Walk through every subset of the mask.
+        occ = 0
+        while True:
+            table[(occ*magic & MASK64) >> shift] = sliding_attacks(sq, occ, directions)
+            occ = (occ - mask) & mask
+            if occ == 0:
+                break
+        masks[sq] = mask
+        shifts[sq] = shift
+        offsets[sq] = len(attacks)
+        attacks.extend(table)
+    return masks, shifts, offsets, np.array(attacks, dtype=np.uint64)
+
+
+ROOK_MASK, ROOK_SHIFT, ROOK_OFFSET, ROOK_ATTACKS = build_magic_tables(ROOK_DIRECTIONS, ROOK_MAGIC)
+BISHOP_MASK, BISHOP_SHIFT, BISHOP_OFFSET, BISHOP_ATTACKS = build_magic_tables(BISHOP_DIRECTIONS, BISHOP_MAGIC)
+
+# Multiplying the lowest set bit by a De Bruijn sequence leaves a different 6 bit pattern in the top bits for every
+# square, which is mapped back to the square index. Numba has no bit_length, so the jitted code finds bits this way.
+DEBRUIJN64 = np.uint64(0x03F79D71B4CB0A89)
+
+
+def build_debruijn_index():
+    index = np.zeros(64, dtype=np.int64)
+    for sq in range(64):
+        index[((1 << sq)*int(DEBRUIJN64) & MASK64) >> 58] = sq
+    return index
+
+
+DEBRUIJN_INDEX = build_debruijn_index()
+
+# Zobrist keys, one random 64 bit number per piece and square plus one for black to move. The hash of a position is
+# the xor of the keys of everything on it, so a move changes it with a few xors. The seed keeps hashes stable between runs.
+ZOBRIST_RANDOM = np.random.RandomState(42)
+ZOBRIST_PIECE = ZOBRIST_RANDOM.randint(0, 2**63, size=(12, 64), dtype=np.uint64)
+ZOBRIST_SIDE = ZOBRIST_RANDOM.randint(0, 2**63, dtype=np.uint64)
+# The same keys as python ints for GameState, xor of python ints is much cheaper than of numpy scalars.
+ZOBRIST_PIECE_KEYS = ZOBRIST_PIECE.tolist()
+ZOBRIST_SIDE_KEY = int(ZOBRIST_SIDE)
+
+
+"""
+Index of the lowest set bit of a non empty bitboard.
+"""
+@njit(cache=True)
+def lsb_index(bb):
+    return DEBRUIJN_INDEX[((bb & (~bb + ONE))*DEBRUIJN64) >> np.uint64(58)]
+
+
+"""
+Magic bitboard lookups of the rook and bishop attacks from sq for the occupancy occ.
+"""
+@njit(cache=True)
+def rook_attacks(sq, occ):
+    return ROOK_ATTACKS[ROOK_OFFSET[sq] + (((occ & ROOK_MASK[sq])*ROOK_MAGIC[sq]) >> ROOK_SHIFT[sq])]
+
+
+@njit(cache=True)
+def bishop_attacks(sq, occ):
+    return BISHOP_ATTACKS[BISHOP_OFFSET[sq] + (((occ & BISHOP_MASK[sq])*BISHOP_MAGIC[sq]) >> BISHOP_SHIFT[sq])]
+
+
+"""
+Piece index of the piece among first..first+5 standing on sq, -1 if there is none.
+"""
+@njit(cache=True)
+def piece_on(bb, sq, first):
+    bit = ONE << np.uint64(sq)
+    for piece in range(first, first + 6):
+        if bb[piece] & bit:
+            return piece
+    return -1
+
+
+"""
+Pack a move into one integer: start square in bits 10..15, end square in bits 4..9 and the captured piece index + 1
+in bits 0..3, which is 0 when nothing is captured.
+"""
+@njit(cache=True)
+def encode_move(from_sq, to_sq, captured):
+    return (from_sq << 10) | (to_sq << 4) | captured
+
+
+"""
+Unpack a move made by encode_move into (start square, end square, captured piece index + 1).
+"""
+def decode_move(move):
+    move = int(move)
+    return move >> 10 & 63, move >> 4 & 63, move & 15
+
+
+"""
+Rank-File notation of a packed move, like e2e4.
+"""
+def move_notation(move):
+    from_sq, to_sq, _ = decode_move(move)
+    return SQUARE_NAMES[from_sq] + SQUARE_NAMES[to_sq]
+
+
+"""
+Write a packed move to out for every square set in the targets bitboard. The start square is end square + offset for
+pawns, for the other pieces offset is 0 and from_sq is used. enemy is the occupancy of the side not to move and
+enemy_first its first piece index.
+"""
+@njit(cache=True)
+def add_moves(bb, from_sq, offset, targets, enemy, enemy_first, out, n):
+    while targets:
+        to_sq = lsb_index(targets)
+        start_sq = to_sq + offset if offset else from_sq
+        # Only squares holding an enemy piece are searched for the captured piece, empty squares capture nothing.
+        if targets & (~targets + ONE) & enemy:
+            out[n] = encode_move(start_sq, to_sq, piece_on(bb, to_sq, enemy_first) + 1)
+        else:
+            out[n] = encode_move(start_sq, to_sq, 0)
+        targets &= targets - ONE
+        n += 1
+    return n
+
+
+"""
+Target squares of all the pawns of one color at once: single pushes, double pushes and the captures whose start
+square is 9 and 7 squares behind the target. White pawns move towards row 0, so a push is a shift right by 8 and
+black pushes shift left. The file masks drop captures that would wrap around the board edge.
+"""
+@njit(cache=True)
+def white_pawn_targets(pawns, empty, enemy):
+    single = (pawns >> np.uint64(8)) & empty
+    # Pawns still on their start row land on the third rank after one step and may take a second one.
+    double = ((single & RANK_3) >> np.uint64(8)) & empty
+    return single, double, (pawns >> np.uint64(9)) & ~FILE_H & enemy, (pawns >> np.uint64(7)) & ~FILE_A & enemy
+
+
+@njit(cache=True)
+def black_pawn_targets(pawns, empty, enemy):
+    single = (pawns << np.uint64(8)) & empty
+    double = ((single & RANK_6) << np.uint64(8)) & empty
+    return single, double, (pawns << np.uint64(9)) & ~FILE_A & enemy, (pawns << np.uint64(7)) & ~FILE_H & enemy
+
+
+"""
+All moves without considering checks for the position in bb. The packed moves are written to out and the number of
+moves is returned.
+"""
+@njit(cache=True)
+def generate_moves(bb, white_to_move, out):
+    occ_w = bb[WP] | bb[WN] | bb[WB] | bb[WR] | bb[WQ] | bb[WK]
+    occ_b = bb[BP] | bb[BN] | bb[BB] | bb[BR] | bb[BQ] | bb[BK]
+    occ = occ_w | occ_b
+    empty = ~occ
+    n = 0
+    # The side to move is decided once here. Only the pawn shifts depend on it, everything after this uses the
+    # locals, and the pawn start squares are the same distances behind the targets with the sign flipped for black.
+    if white_to_move:
+        first, enemy_first, own, enemy, sign = WP, BP, occ_w, occ_b, 1
+        single, double, capture_9, capture_7 = white_pawn_targets(bb[WP], empty, enemy)
+    else:
+        first, enemy_first, own, enemy, sign = BP, WP, occ_b, occ_w, -1
+        single, double, capture_9, capture_7 = black_pawn_targets(bb[BP], empty, enemy)
+    n = add_moves(bb, 0, 8*sign, single, enemy, enemy_first, out, n)
+    n = add_moves(bb, 0, 16*sign, double, enemy, enemy_first, out, n)
+    n = add_moves(bb, 0, 9*sign, capture_9, enemy, enemy_first, out, n)
+    n = add_moves(bb, 0, 7*sign, capture_7, enemy, enemy_first, out, n)
+
+    # Every kind of piece gets its own loop, so nothing has to be decided per piece. Queens are walked with the
+    # bishops for their diagonal moves and with the rooks for their straight ones. Each loop only visits the squares
+    # holding those pieces, lowest set bit first.
+    pieces = bb[first + 1]
+    while pieces:
+        sq = lsb_index(pieces)
+        pieces &= pieces - ONE
+        n = add_moves(bb, sq, 0, KNIGHT_ATTACKS[sq] & ~own, enemy, enemy_first, out, n)
+    pieces = bb[first + 2] | bb[first + 4]
+    while pieces:
+        sq = lsb_index(pieces)
+        pieces &= pieces - ONE
+        n = add_moves(bb, sq, 0, bishop_attacks(sq, occ) & ~own, enemy, enemy_first, out, n)
+    pieces = bb[first + 3] | bb[first + 4]
+    while pieces:
+        sq = lsb_index(pieces)
+        pieces &= pieces - ONE
+        n = add_moves(bb, sq, 0, rook_attacks(sq, occ) & ~own, enemy, enemy_first, out, n)
+    pieces = bb[first + 5]
+    while pieces:
+        sq = lsb_index(pieces)
+        pieces &= pieces - ONE
+        n = add_moves(bb, sq, 0, KING_ATTACKS[sq] & ~own, enemy, enemy_first, out, n)
+    return n
+
+
+"""
+Determine if the pieces of the given color attack the square sq. Every attack table is symmetric, so the square is
+attacked exactly when a piece of the matching kind stands on one of the squares it would attack itself.
+"""
+@njit(cache=True)
+def square_attacked(bb, sq, by_white):
+    occ = np.uint64(0)
+    for piece in range(12):
+        occ |= bb[piece]
+    if by_white:
+        first = WP
+        attackers = BLACK_PAWN_ATTACKS[sq] & bb[WP]
+    else:
+        first = BP
+        attackers = WHITE_PAWN_ATTACKS[sq] & bb[BP]
+    attackers |= KNIGHT_ATTACKS[sq] & bb[first + 1]
+    attackers |= KING_ATTACKS[sq] & bb[first + 5]
+    attackers |= bishop_attacks(sq, occ) & (bb[first + 2] | bb[first + 4])
+    attackers |= rook_attacks(sq, occ) & (bb[first + 3] | bb[first + 4])
+    return attackers != 0
+
+
+"""
+All moves considering checks, written to out like generate_moves. Each move is played on bb and taken back again,
+so bb is unchanged when this returns.
+"""
+@njit(cache=True)
+def generate_legal_moves(bb, white_to_move, out):
+    n = generate_moves(bb, white_to_move, out)
+    first = WP if white_to_move else BP
+    king = WK if white_to_move else BK
+    count = 0
+    for i in range(n):
+        move = out[i]
+        from_sq = (move >> 10) & 63
+        to_sq = (move >> 4) & 63
+        captured = np.int64(move & 15) - 1
+        piece = piece_on(bb, from_sq, first)
+        to_bit = ONE << np.uint64(to_sq)
+        from_to = (ONE << np.uint64(from_sq)) | to_bit
+        bb[piece] ^= from_to
+        if captured >= 0:
+            bb[captured] ^= to_bit
+        legal = not square_attacked(bb, lsb_index(bb[king]), not white_to_move)
+        bb[piece] ^= from_to
+        if captured >= 0:
+            bb[captured] ^= to_bit
+        if legal:
+            out[count] = out[i]
+            count += 1
+    return count
 
 
 class GameState():
     def __init__(self):
-        # Board is a 2D array of size 8X8 and each element of the list has two characters.
+        # The starting board is a 2D list of size 8X8 and each element of the list has two characters.
         # The first character represents the color of the piece 'w' for white and 'b' for black.
         # The second characters represents the type of the piece 'R' for Rook, 'N' for Knight, 'B' for Bishop, 'Q' for Queen, 'K' for King and 'p' for pawn.
-        # '--' denote the empty space in the 2D array of board.
-        self.board = np.full((8, 8), '', dtype='<U2')
-        self.board[0] = ['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR']
-        self.board[1] = ['bp']*8
-        self.board[2:6] = ['--']*8
-        self.board[6] = ['wp']*8
-        self.board[7] = ['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR']
-
-        self.move_functions = {'p': self.get_pawn_moves, 'R': self.get_rook_moves, 'N': self.get_knight_moves, 'B': self.get_bishop_moves, 'Q': self.get_queen_moves, 'K': self.get_king_moves}
+        # '--' denote the empty space in the 2D list of board.
+        board = [
+            ['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR'],
+            ['bp']*8,
+            ['--']*8,
+            ['--']*8,
+            ['--']*8,
+            ['--']*8,
+            ['wp']*8,
+            ['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR']]
+
+        # The position itself is kept as one 64 bit bitboard per piece, square index is row*8 + col.
+        self.bb = np.zeros(12, dtype=np.uint64)
+        # Mailbox gives the piece on a square as piece index + 1 or EMPTY. Reading a square gives
+        # a plain int, SQUARE_CHARS turns it back into the board string when the GUI needs one.
+        self.mailbox = bytearray([EMPTY]*64)
+        # Zobrist hash of the position, kept up to date by make_move and undo_move so it can key a transposition table.
+        self.hash = 0
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] != '--':
+                    piece = PIECE_INDEX[board[r][c]]
+                    self.bb[piece] |= np.uint64(1 << (r*8 + c))
+                    self.mailbox[r*8 + c] = piece + 1
+                    self.hash ^= ZOBRIST_PIECE_KEYS[piece][r*8 + c]
+
         self.whiteToMove = True
-        self.moveLog = []
+        # Each played move is logged as piece << 16 | (captured piece index + 1) << 12 | start << 6 | end,
+        # ply is the number of moves in the log.
+        self.moveLog = np.empty(2048, dtype=np.uint64)
+        self.ply = 0
+        # One preallocated buffer of packed moves per ply, so generating moves allocates nothing. A search keeps the
+        # moves of every ply on its path intact, since the moves after them are generated into the next rows.
+        self.move_buffers = np.empty((64, 256), dtype=np.uint32)
         self.white_king_location = (7,4)
         self.black_king_location = (0,4)
         self.check_mate = False
         self.stale_mate = False
+        # Squares changed since the GUI last drew them, every square still has to be drawn once at the start.
+        self.dirty = set(range(64))
+
+    """
+    Flip the start and end bits of the moving piece and clear the captured piece, and update the hash the same way
+    including the side to move. Calling it twice with the same arguments restores the bitboards and the hash, so it
+    is used by both make_move and undo_move.
+    """
+    def toggle_move(self, piece, from_sq, to_sq, captured):
+        bb = self.bb
+        keys = ZOBRIST_PIECE_KEYS[piece]
+        bb[piece] ^= np.uint64((1 << from_sq) | (1 << to_sq))
+        h = self.hash ^ keys[from_sq] ^ keys[to_sq] ^ ZOBRIST_SIDE_KEY
+        if captured >= 0:
+            bb[captured] ^= np.uint64(1 << to_sq)
+            h ^= ZOBRIST_PIECE_KEYS[captured][to_sq]
+        self.hash = h
 
+    """
+    Play a move packed by encode_move.
+    """
     def make_move(self, move):
-        self.board[move.start_row][move.start_col] = '--'
-        self.board[move.end_row][move.end_col] = move.piece_moved
-        self.moveLog.append(move)
+        # Attributes used more than once are read into locals, which python looks up by index instead of by name.
+        mailbox = self.mailbox
+        ply = self.ply
+        move = int(move)
+        from_sq = move >> 10 & 63
+        to_sq = move >> 4 & 63
+        captured = move & 15
+        piece = mailbox[from_sq] - 1
+        self.toggle_move(piece, from_sq, to_sq, captured - 1)
+        mailbox[to_sq] = piece + 1
+        mailbox[from_sq] = EMPTY
+        if ply == len(self.moveLog):
+            self.moveLog = np.concatenate((self.moveLog, np.empty_like(self.moveLog)))
+        self.moveLog[ply] = (piece << 16) | (captured << 12) | (from_sq << 6) | to_sq
+        self.ply = ply + 1
+        self.dirty.update((from_sq, to_sq))
         self.whiteToMove = not self.whiteToMove
         # Update the king's location if moved.
-        if move.piece_moved == 'wK':
-            self.white_king_location = (move.end_row, move.end_col)
+        if piece == WK:
+            self.white_king_location = (to_sq >> 3, to_sq & 7)
 
-        elif move.piece_moved == 'bK':
-            self.black_king_location = (move.end_row, move.end_col)
+        elif piece == BK:
+            self.black_king_location = (to_sq >> 3, to_sq & 7)
 
     """
     This function undo the last move made when called.
     """
     def undo_move(self):
         # Make sure that there is any move to undo.
-        if len(self.moveLog) != 0 :
-            move = self.moveLog.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+        if self.ply != 0 :
+            mailbox = self.mailbox
+            self.ply -= 1
+            entry = int(self.moveLog[self.ply])
+            piece = entry >> 16
+            captured = entry >> 12 & 15
+            from_sq = entry >> 6 & 63
+            to_sq = entry & 63
+            self.toggle_move(piece, from_sq, to_sq, captured - 1)
+            mailbox[from_sq] = piece + 1
+            mailbox[to_sq] = captured
+            self.dirty.update((from_sq, to_sq))
             # Reverses the turn back
             self.whiteToMove = not self.whiteToMove
             # Update the king's location when move is undo.
-            if move.piece_moved == 'wK':
-                self.white_king_location = (move.end_row, move.end_col)
+            if piece == WK:
+                self.white_king_location = (from_sq >> 3, from_sq & 7)
 
-            elif move.piece_moved == 'bK':
-                self.black_king_location = (move.end_row, move.end_col)
+            elif piece == BK:
+                self.black_king_location = (from_sq >> 3, from_sq & 7)
 
     """
-    All moves considering checks.
+    The board as an 8X8 array of the two character piece strings, for printing.
+    """
+    def get_board(self):
+        return np.array([SQUARE_CHARS[code] for code in self.mailbox]).reshape(8, 8)
+
+    """
+    The move buffer of the current ply, the buffers are doubled like the move log when the game gets longer.
+    """
+    def move_buffer(self):
+        if self.ply == len(self.move_buffers):
+            self.move_buffers = np.concatenate((self.move_buffers, np.empty_like(self.move_buffers)))
+        return self.move_buffers[self.ply]
+
+    """
+    All moves considering checks. Returns a buffer of packed moves and the number of moves in it, the buffer is
+    reused the next time moves are generated at the same ply.
     """
     def get_valid_moves(self):
-        moves = self.get_all_possible_moves()
-        for i in range(len(moves)-1, -1, -1):
-            self.make_move(moves[i])
-            self.whiteToMove = not self.whiteToMove
-            if self.in_check():
-                moves.remove(moves[i])
-            self.whiteToMove = not self.whiteToMove
-            self.undo_move()
-        if len(moves) == 0:
+        moves = self.move_buffer()
+        count = generate_legal_moves(self.bb, self.whiteToMove, moves)
+        if count == 0:
             if self.in_check():
                 self.check_mate = True
             else:
@@ -77,7 +535,7 @@ class GameState():
             self.check_mate = False
             self.stale_mate = False
 
-        return moves
+        return moves, count
 
 
     """
@@ -94,472 +552,27 @@ class GameState():
     Determine if the enemy can attack the square at (r, c)
     """
     def square_under_attack(self, r, c):
-        # Switch to opponent's turn
-        self.whiteToMove = not self.whiteToMove
-        # Generate all opponent's moves
-        opp_moves = self.get_all_possible_moves()
-        self.whiteToMove = not self.whiteToMove
-        for move in opp_moves:
-            # If square is under attack.
-            if move.end_row == r and move.end_col == c:
-                # Again switch the turn back.
-                return True
-        return False
+        return square_attacked(self.bb, r*8 + c, not self.whiteToMove)
 
     """
-    All moves without considering checks.
+    All moves without considering checks. Returns a buffer of packed moves and the number of moves in it, the buffer
+    is reused the next time moves are generated at the same ply.
     """
     def get_all_possible_moves(self):
-        moves = []
-        # Number of rows
-        for r in range(len(self.board)):
-            # Number of columns in a particular row
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]
-                if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove) :
-                    piece = self.board[r][c][1]
-                    # Calls the appropriate move function based on piece type.
-                    self.move_functions[piece](r, c, moves)
-
-        return moves
-
-    """
-    Get all the pawn moves for the pawn located at (row, column) and these moves to the list.
-    """
-    def get_pawn_moves(self, r, c, moves):
-        # When there is white's turn.
-        if self.whiteToMove:
-            # This code is for 1 square move.
-            if self.board[r-1][c] == '--':
-                moves.append(Move((r, c), (r-1, c), self.board))
-                # This code is for 2 square move and is done for the first move only for that pawn.
-                if r == 6 and self.board[r-2][c] == '--':
-                    moves.append(Move((r, c), (r-2, c), self.board))
-
-            # White pawn captures black pawn on the left side.
-            if c-1 >= 0:
-                # Confirms that the enemy piece is black.
-                if self.board[r-1][c-1][0] == 'b':
-                    moves.append(Move((r, c), (r-1, c-1), self.board))
-
-            # White pawn captures black pawn on the right side.
-            if c+1 <=7:
-                # Confirms that the enemy piece is black.
-                if self.board[r-1][c+1][0] == 'b':
-                    moves.append(Move((r, c), (r-1, c+1), self.board))
-
-        # When there is black's turn.
-        else:
-            # This code is for 1 square move.
-            if self.board[r+1][c] == '--':
-                moves.append(Move((r, c), (r+1, c), self.board))
-                # This code is for 2 square move and is done for the first move only for that pawn.
-                if r == 1 and self.board[r+2][c] == '--':
-                    moves.append(Move((r, c), (r+2, c), self.board))
-
-            # Black pawn captures white pawn on the right side.
-            if c-1 >= 0:
-                # Confirms that the enemy piece is white.
-                if self.board[r+1][c-1][0] == 'w':
-                    moves.append(Move((r, c), (r+1, c-1), self.board))
-
-            # Black pawn captures white pawn on the left side.
-            if c+1 <= 7:
-                # Confirms that the enemy piece is white.
-                if self.board[r+1][c+1][0] == 'w':
-                    moves.append(Move((r, c), (r+1, c+1), self.board))
-
-    """
-    Get all the rook moves for the rook located at (row, column) and these moves to the list.
-    """
-    def get_rook_moves(self, r, c, moves):
-        # When there is white's turn
-        if self.whiteToMove:
-            # When white rook is moving upwards.
-            if r-1 >= 0:
-                for i in range(r-1, -1, -1):
-                    # If the upper square is empty then add it in the valid moves list.
-                    if self.board[i][c] == '--':
-                        moves.append(Move((r, c), (i, c), self.board))
-
-                    # If upper square is not empty.
-                    if self.board[i][c] != '--':
-                        # If the piece in the upper square is black then capture that piece.
-                        if self.board[i][c][0] == 'b':
-                            moves.append(Move((r, c), (i, c), self.board))
-
-                        # If the piece in the upper square is white then break out of the for loop.
-                        if self.board[i][c][0] == 'w':
-                            break
-
-            # When white rook is moving leftwards.
-            if c-1 >= 0:
-                for i in range(c-1, -1, -1):
-                    # If the left square is empty then add it in the valid moves list.
-                    if self.board[r][i] == '--':
-                        moves.append(Move((r, c), (r, i), self.board))
-
-                    # If left square is not empty.
-                    if self.board[r][i] != '--':
-                        # If the piece in the left square is black then capture that piece.
-                        if self.board[r][i][0] == 'b':
-                            moves.append(Move((r, c), (r, i), self.board))
-
-                        # If the piece in the left square is white then break out of the for loop.
-                        if self.board[r][i][0] == 'w':
-                            break
-
-            # When white rook is moving rightwards.
-            if c+1 <= 7:
-                for i in range(c+1, 8):
-                    # If the right square is empty then add it in the valid moves list.
-                    if self.board[r][i] == '--':
-                        moves.append(Move((r, c), (r, i), self.board))
-
-                    # If right square is not empty.
-                    if self.board[r][i] != '--':
-                        # If the piece in the right square is black then capture that piece.
-                        if self.board[r][i][0] == 'b':
-                            moves.append(Move((r, c), (r, i), self.board))
-
-                        # If the piece in the right square is white then break out of the for loop.
-                        if self.board[r][i][0] == 'w':
-                            break
-
-            # When white rook is moving downwards.
-            if r+1 <= 7:
-                for i in range(r+1, 8):
-                    # If the lower square is empty then add it in the valid moves list.
-                    if self.board[i][c] == '--':
-                        moves.append(Move((r, c), (i, c), self.board))
-
-                    # If lower square is not empty.
-                    if self.board[i][c] != '--':
-                        # If the piece in the lower square is black then capture that piece.
-                        if self.board[i][c][0] == 'b':
-                            moves.append(Move((r, c), (i, c), self.board))
-
-                        # If the piece in the lower square is white then break out of the for loop.
-                        if self.board[i][c][0] == 'w':
-                            break
-        # When there is black's turn
-        else:
-            # When black rook is moving downwards.
-            if r - 1 >= 0:
-                for i in range(r - 1, -1, -1):
-                    # If the lower square is empty then add it in the valid moves list.
-                    if self.board[i][c] == '--':
-                        moves.append(Move((r, c), (i, c), self.board))
-
-                    # If lower square is not empty.
-                    if self.board[i][c] != '--':
-                        # If the piece in the lower square is white then capture that piece.
-                        if self.board[i][c][0] == 'w':
-                            moves.append(Move((r, c), (i, c), self.board))
-
-                        # If the piece in the lower square is black then break out of the for loop.
-                        if self.board[i][c][0] == 'b':
-                            break
-
-            # When black rook is moving rightwards.
-            if c - 1 >= 0:
-                for i in range(c - 1, -1, -1):
-                    # If the right square is empty then add it in the valid moves list.
-                    if self.board[r][i] == '--':
-                        moves.append(Move((r, c), (r, i), self.board))
-
-                    # If right square is not empty.
-                    if self.board[r][i] != '--':
-                        # If the piece in the right square is white then capture that piece.
-                        if self.board[r][i][0] == 'w':
-                            moves.append(Move((r, c), (r, i), self.board))
-
-                        # If the piece in the right square is black then break out of the for loop.
-                        if self.board[r][i][0] == 'b':
-                            break
-
-            # When black rook is moving leftwards.
-            if c + 1 <= 7:
-                for i in range(c + 1, 8):
-                    # If the left square is empty then add it in the valid moves list.
-                    if self.board[r][i] == '--':
-                        moves.append(Move((r, c), (r, i), self.board))
-
-                    # If left square is not empty.
-                    if self.board[r][i] != '--':
-                        # If the piece in the left square is white then capture that piece.
-                        if self.board[r][i][0] == 'w':
-                            moves.append(Move((r, c), (r, i), self.board))
-
-                        # If the piece in the left square is black then break out of the for loop.
-                        if self.board[r][i][0] == 'b':
-                            break
-
-            # When black rook is moving upwards.
-            if r + 1 <= 7:
-                for i in range(r + 1, 8):
-                    # If the upper square is empty then add it in the valid moves list.
-                    if self.board[i][c] == '--':
-                        moves.append(Move((r, c), (i, c), self.board))
-
-                    # If upper square is not empty.
-                    if self.board[i][c] != '--':
-                        # If the piece in the upper square is white then capture that piece.
-                        if self.board[i][c][0] == 'w':
-                            moves.append(Move((r, c), (i, c), self.board))
-
-                        # If the piece in the upper square is black then break out of the for loop.
-                        if self.board[i][c][0] == 'b':
-                            break
-
-    """
-    Get all the knight moves for the knight located at (row, column) and these moves to the list.
-    """
-    def get_knight_moves(self, r, c, moves):
-        # When there is white's turn.
-        if self.whiteToMove:
-            # When knight is moving on the inner left side.
-            if c-1 >= 0:
-                # When the knight is making move to the up on the inner left side.
-                if r-2 >= 0:
-                    if self.board[r-2][c-1] == '--':
-                        # If the square in empty then append that move in the list.
-                        moves.append(Move((r, c), (r-2, c-1), self.board))
-
-                    if self.board[r-2][c-1][0] == 'b':
-                        # If there is an enemy piece at the square then capture that.
-                        moves.append(Move((r, c), (r - 2, c - 1), self.board))
-
-                # When the knight is making move to the down on the inner left side.
-                if r+2 <=7:
-                    if self.board[r+2][c-1] == '--':
-                        # If the square in empty then append that move in the list.
-                        moves.append(Move((r, c), (r+2, c-1), self.board))
-
-                    if self.board[r+2][c-1][0] == 'b':
-                        # If there is an enemy piece at the square then capture that.
-                        moves.append(Move((r, c), (r+2, c-1), self.board))
-
-            # When the knight is moving on the outer left side.
-            if c-2 >= 0:
-                # When knight is making move to the up on the outer left side.
-                if r-1 >= 0:
-                    if self.board[r-1][c-2] == '--':
-                        # If the square is empty then append that move in the list.
-                        moves.append(Move((r, c), (r-1, c-2), self.board))
-
-                    if self.board[r-1][c-2][0] == 'b':
-                        # If there is an enemy piece at the square then capture that
-                        moves.append(Move((r, c), (r-1, c-2), self.board))
-
-                # When the knight is making move to the down on the outer left side.
-                if r+1 <= 7:
-                    if self.board[r+1][c-2] == '--':
-                        # If the square is empty then append that move in the list.
-                        moves.append(Move((r, c), (r+1, c-2), self.board))
-
-                    if self.board[r+1][c-2][0] == 'b':
-                        # If there is an enemy piece at the square then capture that.
-                        moves.append(Move((r, c), (r+1, c-2), self.board))
-
-            # When the knight is moving on the inner right side.
-            if c+1 <= 7:
-                # When the knight is making move to the up on the inner right side.
-                if r-2 >= 0:
-                    if self.board[r-2][c+1] == '--':
-                        # If the square is empty then append that move in the list.
-                        moves.append(Move((r, c), (r-2, c+1), self.board))
-
-                    if self.board[r-2][c+1][0] == 'b':
-                        # If there is an enemy piece at the square then capture that
-                        moves.append(Move((r, c), (r-2, c+1), self.board))
-
-                # When the knight is making move to the down on the inner right side.
-                if r+2 <= 7:
-                    if self.board[r+2][c+1] == '--':
-                        # If the square is empty then append that move in the list.
-                        moves.append(Move((r, c), (r+2, c+1), self.board))
-
-                    if self.board[r+2][c+1][0] == 'b':
-                        # If there is an enemy piece at the square then capture that
-                        moves.append(Move((r, c), (r+2, c+1), self.board))
-
-            # When the knight is moving on the outer right side.
-            if c+2 <= 7:
-                # When the knight is making move to the up on the outer right side.
-                if r-1 >= 0:
-                    if self.board[r-1][c+2] == '--':
-                        # If the square is empty then append that move in the list.
-                        moves.append(Move((r, c), (r-1, c+2), self.board))
-
-                    if self.board[r-1][c+2][0] == 'b':
-                        # If there is an enemy piece at the square then capture that
-                        moves.append(Move((r, c), (r-1, c+2), self.board))
-
-                # When the knight is making move to the down on the outer right side.
-                if r+1 <= 7:
-                    if self.board[r+1][c+2] == '--':
-                        # If the square is empty then append that move in the list.
-                        moves.append(Move((r, c), (r+1, c+2), self.board))
-
-                    if self.board[r+1][c+2][0] == 'b':
-                        # If there is an enemy piece at the square then capture that
-                        moves.append(Move((r, c), (r+1, c+2), self.board))
-
-        # When there is black's turn
-        else:
-            # When knight is moving on the inner right side.
-            if c-1 >= 0:
-                # When the knight is making move to the down on the inner right side.
-                if r-2 >= 0:
-                    if self.board[r-2][c-1] == '--':
-                        # If the square in empty then append that move in the list.
-                        moves.append(Move((r, c), (r-2, c-1), self.board))
-
-                    if self.board[r-2][c-1][0] == 'w':
-                        # If there is an enemy piece at the square then capture that.
-                        moves.append(Move((r, c), (r - 2, c - 1), self.board))
-
-                # When the knight is making move to the up on the inner right side.
-                if r+2 <=7:
-                    if self.board[r+2][c-1] == '--':
-                        # If the square in empty then append that move in the list.
-                        moves.append(Move((r, c), (r+2, c-1), self.board))
-
-                    if self.board[r+2][c-1][0] == 'w':
-                        # If there is an enemy piece at the square then capture that.
-                        moves.append(Move((r, c), (r+2, c-1), self.board))
-
-            # When knight is moving on the outer right side.
-            if c-2 >= 0:
-                # When the knight is making move to the down on the outer right side.
-                if r-1 >= 0:
-                    if self.board[r-1][c-2] == '--':
-                        # If the square is empty then append that move in the list.
-                        moves.append(Move((r, c), (r-1, c-2), self.board))
-
-                    if self.board[r-1][c-2][0] == 'w':
-                        # If there is an enemy piece at the square then capture that.
-                        moves.append(Move((r, c), (r+2, c-1), self.board))
-
-                # When the knight is making move to the up on the outer right side.
-                if r+1 <= 7:
-                    if self.board[r+1][c-2] == '--':
-                        # If the square in empty then append that move in the list.
-                        moves.append(Move((r, c), (r+1, c-2), self.board))
-
-                    if self.board[r+1][c-2][0] == 'w':
-                        # If there is an enemy piece at the square then capture that.
-                        moves.append(Move((r, c), (r+1, c-2), self.board))
-
-            # When knight is moving on the inner left side.
-            if c+1 <= 7:
-                # When the knight is making move to the down on the inner left side.
-                if r-2 >= 0:
-                    if self.board[r-2][c+1] == '--':
-                        # If the square is empty then append that move in the list.
-                        moves.append(Move((r, c), (r-2, c+1), self.board))
-
-                    if self.board[r-2][c+1][0] == 'w':
-                        # If there is an enemy piece at the square then capture that.
-                        moves.append(Move((r, c), (r-2, c+1), self.board))
-
-                # When the knight is making move to the up on the outer right side.
-                if r+2 <= 7:
-                    if self.board[r+2][c+1] == '--':
-                        # If the square in empty then append that move in the list.
-                        moves.append(Move((r, c), (r+2, c+1), self.board))
-
-                    if self.board[r+2][c+1][0] == 'w':
-                        # If there is an enemy piece at the square then capture that.
-                        moves.append(Move((r, c), (r+2, c+1), self.board))
-
-            # When knight is moving on the outer left side.
-            if c+2 <= 7:
-                # When the knight is making move to the down on the outer left side.
-                if r-1 >= 0:
-                    if self.board[r-1][c+2] == '--':
-                        # If the square is empty then append that move in the list.
-                        moves.append(Move((r, c), (r-1, c+2), self.board))
-
-                    if self.board[r-1][c+2][0] == 'w':
-                        # If there is an enemy piece at the square then capture that.
-                        moves.append(Move((r, c), (r-1, c+2), self.board))
-
-                # When the knight is making move to the up on the outer left side.
-                if r+1 <= 7:
-                    if self.board[r+1][c+2] == '--':
-                        # If the square in empty then append that move in the list.
-                        moves.append(Move((r, c), (r+1, c+2), self.board))
-
-                    if self.board[r+1][c+2][0] == 'w':
-                        # If there is an enemy piece at the square then capture that.
-                        moves.append(Move((r, c), (r+1, c+2), self.board))
-
-    """
-    Get all the bishop moves for the bishop located at (row, column) and these moves to the list.
-    """
-    def get_bishop_moves(self, r, c, moves):
-        # Defining the directions in which it moves.
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))
-        # Make the enemy according to the move a piece.
-        enemy_color = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):
-                end_row = r + d[0]*i
-                end_col = c + d[1]*i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-                    # If the end square is empty then append that move in the list.
-                    if end_piece == "--":
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    # If the piece at the end square is enemy piece then capture that.
-                    elif end_piece[0] == enemy_color:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
-    """
-    Get all the queen moves for the queen located at (row, column) and these moves to the list.
-    """
-    def get_queen_moves(self, r, c, moves):
-        self.get_rook_moves(r, c, moves)
-        self.get_bishop_moves(r, c, moves)
-
-    """
-    Get all the king moves for the king located at (row, column) and these moves to the list.
-    """
-    def get_king_moves(self, r, c, moves):
-        king_moves = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
-        ally_color = "w" if self.whiteToMove else "b"
-        for i in range(8):
-            end_row = r + king_moves[i][0]
-            end_col = c + king_moves[i][1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:
-                    moves.append(Move((r, c), (end_row, end_col), self.board))
+        moves = self.move_buffer()
+        return moves, generate_moves(self.bb, self.whiteToMove, moves)
 
 class Move():
-    # Maps key to values.
-    # Key : Value
-    ranks_to_rows = {"1" :7, "2" :6, "3" :5, "4" :4, "5" :3, "6" :2, "7" :1, "8" :0}
-    rows_to_ranks = {v: k for k, v in ranks_to_rows.items()}
-    files_to_cols = {"a" :0, "b" :1, "c" :2, "d" :3, "e" :4, "f" :5, "g" :6, "h" :7}
-    cols_to_files = {v: k for k, v in files_to_cols.items()}
-
-
-    def __init__(self, start_sq, end_sq, board):
+    def __init__(self, start_sq, end_sq, mailbox):
         self.start_row = start_sq[0]
         self.start_col = start_sq[1]
         self.end_row = end_sq[0]
         self.end_col = end_sq[1]
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col]
-        self.move_ID = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+        self.piece_moved = SQUARE_CHARS[mailbox[self.start_row*8 + self.start_col]]
+        self.piece_captured = SQUARE_CHARS[mailbox[self.end_row*8 + self.end_col]]
+        # The ID is the packed form of the move, the same number the move generator produces.
+        self.move_ID = encode_move(self.start_row*8 + self.start_col, self.end_row*8 + self.end_col,
+                                   mailbox[self.end_row*8 + self.end_col])
 
     """
     Overriding the equals method.
@@ -573,4 +586,4 @@ class Move():
         return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
 
     def get_rank_file(self, r, c):
-        return self.cols_to_files[c] + self.rows_to_ranks[r]
\ No newline at end of file
+        return SQUARE_NAMES[r*8 + c]
\ No newline at end of file
@@ -14,15 +14,37 @@ SQ_SIZE = HEIGHT // DIMENSION
 # Maximum FPS is used later on in animations.
 MAX_FPS = 15
 IMAGES = {}
+# The same images indexed by the mailbox value of a square, so drawing a square needs no string lookups.
+MAILBOX_IMAGES = []
+# The empty checkered board, drawn once by init_board_surface.
+BOARD_SURFACE = None
 
 """
 Initializing a global directory for images and remember this will be called exactly once.
+It has to be called after the display mode is set, since the images are converted to the display's pixel format.
 """
 def load_images():
     pieces = ['bR', 'bN', 'bB', 'bQ', 'bK', 'bp', 'wR', 'wN', 'wB', 'wQ', 'wK', 'wp']
     for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("Images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
+        # Converting once here lets every blit copy the pixels directly instead of converting them each frame.
+        IMAGES[piece] = p.transform.scale(p.image.load("Images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE)).convert_alpha()
     # NOTE : We can access an image by saying "IMAGES['wp']"
+    MAILBOX_IMAGES[:] = [IMAGES.get(piece) for piece in ChessEngine.SQUARE_CHARS]
+
+
+"""
+Draw the squares of the board once on their own surface. Remember that the top left corner of the chess board from both black and white side is light colored square.
+Like load_images this has to be called after the display mode is set.
+"""
+def init_board_surface():
+    global BOARD_SURFACE
+    BOARD_SURFACE = p.Surface((WIDTH, HEIGHT))
+    colors = [p.Color("white"), p.Color("dark green")]
+    for r in range(DIMENSION):
+        for c in range(DIMENSION):
+            color = colors[((r+c) % 2)]
+            p.draw.rect(BOARD_SURFACE, color, p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    BOARD_SURFACE = BOARD_SURFACE.convert()
 
 
 """
@@ -31,24 +53,35 @@ This the main driver for our code. This will handle all user input and updating
 def main():
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
+    # This can be run once before the while loop, right after the display exists.
+    load_images()
+    init_board_surface()
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
     gs = ChessEngine.GameState()
-    valid_moves = gs.get_valid_moves()
+    # Set of the packed valid moves, checking a clicked move against it is a single hash lookup.
+    valid_moves, valid_count = gs.get_valid_moves()
+    valid_set = set(valid_moves[:valid_count].tolist())
     # Flag variable for when a move is made.
     move_made = False
-    print(gs.board)
-    # This can be run once before the while loop.
-    load_images()
+    print(gs.get_board())
     running = True
     # No particular square is selected, it just keeps track of the last click of the user. (tuple : (row, col))
     sq_selected = ()
     # This keeps track of players click. ( two tuples : [(6,4) first click on pawn and then (4,4) to move the pawn to this square.])
     player_clicks = []
     while running:
-        for e in p.event.get():
+        # When there is nothing new to draw, sleep until the next event instead of waking up every frame.
+        if gs.dirty:
+            events = p.event.get()
+        else:
+            events = [p.event.wait()] + p.event.get()
+        for e in events:
             if e.type == p.QUIT:
                 running = False
+            # The window was uncovered, so its contents have to be drawn again.
+            elif e.type == p.VIDEOEXPOSE:
+                gs.dirty.update(range(DIMENSION*DIMENSION))
             elif e.type == p.MOUSEBUTTONDOWN:
                 # This gives the (x, y) location of the mouse.
                 location = p.mouse.get_pos()
@@ -66,12 +99,12 @@ def main():
                     player_clicks.append(sq_selected)
                 # After the player has made two clicks
                 if len(player_clicks) == 2:
-                    move = ChessEngine.Move(player_clicks[0], player_clicks[1], gs.board)
+                    move = ChessEngine.Move(player_clicks[0], player_clicks[1], gs.mailbox)
                     # Print the starting square and ending square moves in Rank-File notations.
                     print(move.get_chess_notation())
                     # Makes the move after getting starting square and ending square location.
-                    if move in valid_moves:
-                        gs.make_move(move)
+                    if move.move_ID in valid_set:
+                        gs.make_move(move.move_ID)
                         move_made = True
                         # Resets all the clicks made to empty to take other moves input.
                         sq_selected = ()
@@ -86,42 +119,59 @@ def main():
                     move_made = True
 
         if move_made:
-            valid_moves = gs.get_valid_moves()
+            valid_moves, valid_count = gs.get_valid_moves()
+            valid_set = set(valid_moves[:valid_count].tolist())
             move_made = False
 
-        draw_game_state(screen, gs)
-        clock.tick(MAX_FPS)
-        p.display.flip()
+        dirty_rects = draw_game_state(screen, gs)
+        # Only push the squares that were drawn to the display, nothing at all when the board did not change.
+        # The frame rate is only limited when something was drawn, an idle loop is already blocked in event.wait.
+        if dirty_rects:
+            p.display.update(dirty_rects)
+            clock.tick(MAX_FPS)
 
 """
-Responsible for all the graphics within a current Game State.
+Responsible for all the graphics within a current Game State. Only the squares changed since the last call are drawn
+and their rectangles are returned.
 """
 def draw_game_state(screen, gs):
+    squares = gs.dirty
+    if not squares:
+        return []
     # Draw squares on the board.
-    draw_board(screen)
+    draw_board(screen, squares)
     # Draw pieces on the top of the board.
-    draw_pieces(screen, gs.board)
+    draw_pieces(screen, gs.mailbox, squares)
+    gs.dirty = set()
+    return [square_rect(sq) for sq in squares]
 
 """
-Draw squares on the board. Remember that the top left corner of the chess board from both black and white side is light colored square.
+Rectangle of the square with index row*8 + col on the screen.
 """
-def draw_board(screen):
-    colors = [p.Color("white"), p.Color("dark green")]
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[((r+c) % 2)]
-            p.draw.rect(screen, color, p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+def square_rect(sq):
+    return p.Rect((sq % DIMENSION)*SQ_SIZE, (sq // DIMENSION)*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+
+"""
+Draw the given squares on the board by copying them from the prebuilt board surface.
+"""
+def draw_board(screen, squares):
+    if len(squares) == DIMENSION*DIMENSION:
+        screen.blit(BOARD_SURFACE, (0, 0))
+        return
+    for sq in squares:
+        rect = square_rect(sq)
+        screen.blit(BOARD_SURFACE, rect, rect)
 
 
 """
-Draw the pieces on the board using current GameState.board
+Draw the pieces standing on the given squares using current GameState.mailbox
 """
-def draw_pieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":
-                screen.blit(IMAGES[piece], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+def draw_pieces(screen, mailbox, squares):
+    blit = screen.blit
+    for sq in squares:
+        code = mailbox[sq]
+        if code != ChessEngine.EMPTY:
+            blit(MAILBOX_IMAGES[code], square_rect(sq))
 
 
 if __name__ == "__main__":